@@ -0,0 +1,67 @@
+"""backfill milk_detail_ids from milk_details
+
+Revision ID: 1c9e5b2f7a04
+Revises: 
+Create Date: 2026-10-19 09:05:47.631207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from sharding import for_each_shard
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c9e5b2f7a04'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+milk_detail_ids = sa.table('milk_detail_ids', sa.column('id', sa.Integer()), sa.column('farm_name', sa.String()))
+
+
+# Directory entries for the readings already on another shard in MILK_SHARD_URLS
+def backfill_from_shard(bind, conn):
+    if 'milk_details' not in sa.inspect(conn).get_table_names():
+        return
+    known = {id for (id,) in bind.execute(sa.select(milk_detail_ids.c.id))}
+    rows = [{'id': id, 'farm_name': farm_name}
+            for id, farm_name in conn.execute(sa.text('SELECT id, farm_name FROM milk_details'))
+            if id not in known]
+    if rows:
+        bind.execute(milk_detail_ids.insert(), rows)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    tables = sa.inspect(bind).get_table_names()
+    if 'milk_detail_ids' not in tables:
+        op.create_table(
+            'milk_detail_ids',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('farm_name', sa.String(100), nullable=False),
+            sqlite_autoincrement=True,
+        )
+    if 'milk_details' in tables:
+        op.execute("""
+            INSERT INTO milk_detail_ids (id, farm_name)
+            SELECT id, farm_name FROM milk_details
+            WHERE id NOT IN (SELECT id FROM milk_detail_ids)
+        """)
+    for_each_shard(bind.engine.url, lambda conn: backfill_from_shard(bind, conn))
+
+    # New ids must start past the backfilled ones. SQLite's autoincrement
+    # counter follows explicit ids by itself, Postgres' sequence does not.
+    if bind.dialect.name == 'postgresql':
+        op.execute("""
+            SELECT setval(pg_get_serial_sequence('milk_detail_ids', 'id'), COALESCE(MAX(id), 0) + 1, false)
+            FROM milk_detail_ids
+        """)
+
+
+def downgrade() -> None:
+    # The directory is still needed by the app, only the backfill is data
+    pass
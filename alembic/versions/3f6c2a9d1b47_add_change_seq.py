@@ -0,0 +1,80 @@
+"""add change_seq for delta sync
+
+Revision ID: 3f6c2a9d1b47
+Revises: 1c9e5b2f7a04
+Create Date: 2026-10-19 10:12:31.402918
+
+"""
+import time
+from typing import Sequence, Union
+
+from alembic import op
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+import sqlalchemy as sa
+
+from sharding import for_each_shard
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6c2a9d1b47'
+down_revision: Union[str, None] = '1c9e5b2f7a04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Mirrors sync.change_sequence. sync_tombstones is created by the apps on startup.
+change_sequence = sa.Table(
+    'change_sequence', sa.MetaData(),
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), primary_key=True),
+    sa.Column('reserved_at', sa.Float(), nullable=False),
+    sa.Column('released', sa.Boolean(), nullable=False),
+    sqlite_autoincrement=True,
+)
+
+TABLES = ['farm_details', 'payments', 'products_dispatched']
+
+
+# Give every existing row of conn's table a seq in id order, drawn from the
+# main database, so a first sync from 0 returns it
+def backfill(bind, conn, table):
+    ids = [id for (id,) in conn.execute(sa.text(f'SELECT id FROM {table} WHERE change_seq IS NULL ORDER BY id'))]
+    for id in ids:
+        seq = bind.execute(change_sequence.insert().values(reserved_at=time.time(), released=True)).inserted_primary_key[0]
+        conn.execute(sa.text(f'UPDATE {table} SET change_seq = :seq WHERE id = :id'), {'seq': seq, 'id': id})
+
+
+def add_change_seq(bind, ops, conn, table):
+    # Tables of a service that never ran against this database are skipped
+    if table not in sa.inspect(conn).get_table_names():
+        return
+    columns = [column['name'] for column in sa.inspect(conn).get_columns(table)]
+    if 'change_seq' not in columns:
+        ops.add_column(table, sa.Column('change_seq', sa.BigInteger(), nullable=True))
+        ops.create_index(f'ix_{table}_change_seq', table, ['change_seq'])
+    backfill(bind, conn, table)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    change_sequence.create(bind, checkfirst=True)
+    for table in TABLES + ['milk_details']:
+        add_change_seq(bind, op, bind, table)
+    # milk_details on every other shard in MILK_SHARD_URLS
+    for_each_shard(bind.engine.url, lambda conn: add_change_seq(
+        bind, Operations(MigrationContext.configure(conn)), conn, 'milk_details'))
+
+
+def drop_change_seq(ops, conn, table):
+    if table not in sa.inspect(conn).get_table_names():
+        return
+    if 'change_seq' in [column['name'] for column in sa.inspect(conn).get_columns(table)]:
+        ops.drop_index(f'ix_{table}_change_seq', table_name=table)
+        ops.drop_column(table, 'change_seq')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    for table in TABLES + ['milk_details']:
+        drop_change_seq(op, bind, table)
+    for_each_shard(bind.engine.url, lambda conn: drop_change_seq(
+        Operations(MigrationContext.configure(conn)), conn, 'milk_details'))
@@ -0,0 +1,116 @@
+"""store milk statuses as status_vocabulary codes
+
+Revision ID: 8d41e07c5a93
+Revises: 3f6c2a9d1b47
+Create Date: 2026-10-19 16:40:12.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+import sqlalchemy as sa
+
+from sharding import for_each_shard
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41e07c5a93'
+down_revision: Union[str, None] = '3f6c2a9d1b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MILK_STATUSES = [('snf', 'snf_status'), ('alcohol', 'alcohol_status'), ('antibiotic', 'antibiotic_status')]
+
+status_vocabulary = sa.table(
+    'status_vocabulary',
+    sa.column('id', sa.SmallInteger()), sa.column('kind', sa.String()),
+    sa.column('name', sa.String()), sa.column('ref_count', sa.Integer()),
+)
+
+
+# Add the statuses used in conn's table to the vocabulary in the main
+# database, counting their rows, and return their codes by name
+def add_vocabulary(bind, conn, kind, table, column):
+    codes = {}
+    counts = conn.execute(sa.text(
+        f'SELECT {column}, COUNT(*) FROM {table} WHERE {column} IS NOT NULL GROUP BY {column}')).fetchall()
+    for name, count in counts:
+        code = bind.execute(sa.select(status_vocabulary.c.id).where(status_vocabulary.c.kind == kind)
+                            .where(status_vocabulary.c.name == name)).scalar()
+        if code is None:
+            bind.execute(status_vocabulary.insert().values(kind=kind, name=name, ref_count=count))
+            code = bind.execute(sa.select(status_vocabulary.c.id).where(status_vocabulary.c.kind == kind)
+                                .where(status_vocabulary.c.name == name)).scalar()
+        else:
+            bind.execute(status_vocabulary.update().where(status_vocabulary.c.id == code)
+                         .values(ref_count=status_vocabulary.c.ref_count + count))
+        codes[name] = code
+    return codes
+
+
+def columns(conn, table):
+    return [column['name'] for column in sa.inspect(conn).get_columns(table)]
+
+
+# milk_details on the main database and every other shard in MILK_SHARD_URLS
+def upgrade_milk_details(bind, ops, conn):
+    if 'milk_details' not in sa.inspect(conn).get_table_names():
+        return
+    for kind, column in MILK_STATUSES:
+        if column not in columns(conn, 'milk_details'):
+            continue
+        codes = add_vocabulary(bind, conn, kind, 'milk_details', column)
+        ops.add_column('milk_details', sa.Column(f'{column}_code', sa.SmallInteger(), nullable=True))
+        for name, code in codes.items():
+            conn.execute(sa.text(f'UPDATE milk_details SET {column}_code = :code WHERE {column} = :name'),
+                         {'code': code, 'name': name})
+        # Batch mode so SQLite shards, which cannot alter columns, are rebuilt instead
+        with ops.batch_alter_table('milk_details') as batch:
+            batch.alter_column(f'{column}_code', existing_type=sa.SmallInteger(), nullable=False)
+            batch.drop_column(column)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if 'status_vocabulary' not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            'status_vocabulary',
+            sa.Column('id', sa.SmallInteger().with_variant(sa.Integer(), 'sqlite'), primary_key=True),
+            sa.Column('kind', sa.String(20), nullable=False),
+            sa.Column('name', sa.String(20), nullable=False),
+            sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.UniqueConstraint('kind', 'name', name='uq_status_vocabulary_kind_name'),
+        )
+
+    upgrade_milk_details(bind, op, bind)
+    for_each_shard(bind.engine.url, lambda conn: upgrade_milk_details(
+        bind, Operations(MigrationContext.configure(conn)), conn))
+    if 'payments' in sa.inspect(bind).get_table_names():
+        add_vocabulary(bind, bind, 'payment', 'payments', 'status')
+
+
+def downgrade_milk_details(bind, ops, conn):
+    if 'milk_details' not in sa.inspect(conn).get_table_names():
+        return
+    names = {row.id: row.name for row in bind.execute(sa.select(status_vocabulary.c.id, status_vocabulary.c.name))}
+    for kind, column in MILK_STATUSES:
+        if f'{column}_code' not in columns(conn, 'milk_details'):
+            continue
+        ops.add_column('milk_details', sa.Column(column, sa.String(20), nullable=True))
+        codes = [code for (code,) in conn.execute(sa.text(f'SELECT DISTINCT {column}_code FROM milk_details'))]
+        for code in codes:
+            conn.execute(sa.text(f'UPDATE milk_details SET {column} = :name WHERE {column}_code = :code'),
+                         {'name': names[code], 'code': code})
+        with ops.batch_alter_table('milk_details') as batch:
+            batch.alter_column(column, existing_type=sa.String(20), nullable=False)
+            batch.drop_column(f'{column}_code')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    downgrade_milk_details(bind, op, bind)
+    for_each_shard(bind.engine.url, lambda conn: downgrade_milk_details(
+        bind, Operations(MigrationContext.configure(conn)), conn))
+    op.drop_table('status_vocabulary')
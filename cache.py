@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify
+
+
+# Bounded in-process LRU with per-entry TTL. Every delete bumps one
+# generation counter; a set tagged with an older generation is dropped.
+class LRUBackend:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.deletes = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def generation(self, key):
+        with self.lock:
+            return self.deletes
+
+    def set(self, key, value, generation):
+        with self.lock:
+            if generation != self.deletes:
+                return
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.deletes += 1
+            self.entries.pop(key, None)
+
+    def stats(self):
+        return {'backend': 'lru', 'size': len(self.entries), 'maxsize': self.maxsize,
+                'ttl': self.ttl, 'evictions': self.evictions}
+
+
+# Shared cache in Redis so every worker and service sees the same entries and
+# invalidations. Each key has a generation counter in Redis, bumped by every
+# delete, and a set only lands if the generation is still the one read before
+# the load. Needs the optional redis package.
+class RedisBackend:
+    SET_IF_CURRENT = """
+        if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+            redis.call('SETEX', KEYS[1], ARGV[2], ARGV[3])
+        end
+    """
+
+    def __init__(self, url, ttl=300, prefix='object-cache:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.set_if_current = self.client.register_script(self.SET_IF_CURRENT)
+
+    def generation_key(self, key):
+        return f'{self.prefix}generation:{key}'
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def generation(self, key):
+        value = self.client.get(self.generation_key(key))
+        return value.decode() if value is not None else '0'
+
+    def set(self, key, value, generation):
+        self.set_if_current(keys=[self.prefix + key, self.generation_key(key)],
+                            args=[generation, self.ttl, json.dumps(value, default=str)])
+
+    def delete(self, key):
+        # The generation outlives any entry set before the delete
+        pipe = self.client.pipeline()
+        pipe.incr(self.generation_key(key))
+        pipe.expire(self.generation_key(key), self.ttl)
+        pipe.delete(self.prefix + key)
+        pipe.execute()
+
+    def stats(self):
+        # Redis evicts by its own maxmemory policy, see INFO stats for those counts
+        return {'backend': 'redis', 'ttl': self.ttl}
+
+
+# Read-through cache of serialized records, keyed by table name and id
+class ObjectCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, table, id):
+        return f'{table}:{id}'
+
+    # Cached value for table/id, or loader() stored for next time. A load that
+    # overlaps an invalidation, in this worker or any other sharing the
+    # backend, is returned but not stored, so it cannot overwrite the value
+    # written by the PUT or DELETE behind it.
+    def get_or_load(self, table, id, loader):
+        key = self.key(table, id)
+        value = self.backend.get(key)
+        with self.lock:
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+        generation = self.backend.generation(key)
+        value = loader()
+        self.backend.set(key, value, generation)
+        return value
+
+    def invalidate(self, table, id):
+        self.backend.delete(self.key(table, id))
+        with self.lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(self.backend.stats(), hits=self.hits, misses=self.misses, invalidations=self.invalidations,
+                        hit_rate=self.hits / lookups if lookups else 0.0)
+
+    # Register GET /api/admin/cache with the counters above
+    def init_app(self, app):
+        @app.route('/api/admin/cache', methods=['GET'])
+        def cache_stats():
+            return jsonify(self.stats())
+
+        return cache_stats
+
+
+# OBJECT_CACHE_URL=redis://... selects the shared backend, otherwise an LRU of
+# OBJECT_CACHE_SIZE entries. OBJECT_CACHE_TTL is in seconds for both.
+def create_object_cache(app):
+    url = app.config.get('OBJECT_CACHE_URL', os.getenv('OBJECT_CACHE_URL'))
+    ttl = int(app.config.get('OBJECT_CACHE_TTL', os.getenv('OBJECT_CACHE_TTL', 300)))
+    if url:
+        backend = RedisBackend(url, ttl=ttl)
+    else:
+        backend = LRUBackend(maxsize=int(app.config.get('OBJECT_CACHE_SIZE', os.getenv('OBJECT_CACHE_SIZE', 1024))), ttl=ttl)
+    object_cache = ObjectCache(backend)
+    object_cache.init_app(app)
+    return object_cache
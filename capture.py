@@ -0,0 +1,116 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+# JSON keys whose values are replaced by a stable pseudonym in captures. The
+# same input always maps to the same pseudonym so a farm created in a capture
+# is still found by the milk readings and payments that reference it.
+SENSITIVE_KEYS = {'farm_name', 'farmer_name', 'farmer_phone', 'caretaker', 'caretaker_phone',
+                  'location', 'username', 'password'}
+
+# Long-lived or admin endpoints that make no sense to replay
+SKIP_PREFIXES = ('/api/stream', '/api/admin')
+
+# Request headers kept in captures and sent again on replay. Idempotency-Key
+# lets a replay reproduce client retries instead of creating duplicates.
+CAPTURED_HEADERS = ('Idempotency-Key',)
+
+
+def pseudonym(value, salt):
+    digest = hashlib.sha256(f'{salt}:{value}'.encode('utf-8')).hexdigest()
+    return f'anon_{digest[:12]}'
+
+
+def anonymize(data, salt):
+    if isinstance(data, dict):
+        return {key: pseudonym(value, salt) if key in SENSITIVE_KEYS and value is not None else anonymize(value, salt)
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [anonymize(item, salt) for item in data]
+    return data
+
+
+def captured_headers(environ):
+    headers = {}
+    for name in CAPTURED_HEADERS:
+        value = environ.get('HTTP_' + name.upper().replace('-', '_'))
+        if value is not None:
+            headers[name] = value
+    return headers
+
+
+# WSGI middleware writing one JSON record per request to a capture file
+class TrafficCapture:
+    def __init__(self, wsgi_app, path, service, salt=''):
+        self.wsgi_app = wsgi_app
+        self.service = service
+        self.salt = salt
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', buffering=1)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(SKIP_PREFIXES):
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length else b''
+        environ['wsgi.input'] = io.BytesIO(body)
+
+        record = {
+            'service': self.service,
+            'time': time.time(),
+            'method': environ.get('REQUEST_METHOD'),
+            'path': path,
+            'query': environ.get('QUERY_STRING', ''),
+            'content_type': environ.get('CONTENT_TYPE', ''),
+            'headers': captured_headers(environ),
+            'body': self.anonymize_body(body),
+        }
+
+        def capture_start_response(status, headers, exc_info=None):
+            record['status'] = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        started = time.perf_counter()
+        result = self.wsgi_app(environ, capture_start_response)
+        return self.iterate(result, record, started)
+
+    # Timing covers the whole response body, the record is written once it is sent
+    def iterate(self, result, record, started):
+        try:
+            for chunk in result:
+                yield chunk
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+            record['duration'] = time.perf_counter() - started
+            self.write(record)
+
+    def anonymize_body(self, body):
+        if not body:
+            return None
+        try:
+            return anonymize(json.loads(body), self.salt)
+        except ValueError:
+            # Only JSON bodies are kept, anything else cannot be anonymized field by field
+            return None
+
+    def write(self, record):
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line + '\n')
+
+
+# Wrap app.wsgi_app when CAPTURE_FILE is set, otherwise leave the app untouched
+def init_capture(app, service):
+    path = app.config.get('CAPTURE_FILE', os.getenv('CAPTURE_FILE'))
+    if path:
+        salt = app.config.get('CAPTURE_SALT', os.getenv('CAPTURE_SALT', ''))
+        app.wsgi_app = TrafficCapture(app.wsgi_app, path, service, salt)
@@ -0,0 +1,96 @@
+import json
+import threading
+import uuid
+from collections import deque
+
+from flask import Response, jsonify, request, stream_with_context
+
+
+# Incoming values that differ from what the record holds, checked before they are assigned
+def changed_fields(record, values):
+    return {name: value for name, value in values.items() if getattr(record, name) != value}
+
+
+def format_event(boot, event):
+    payload = {'op': event['op'], 'id': event['row_id'], 'fields': event['fields']}
+    return f"id: {boot}-{event['id']}\nevent: {event['topic']}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+# In-process broadcast of insert/update/delete events. Every subscriber reads
+# from the same bounded buffer, which also serves Last-Event-ID resumes.
+# Event ids are "<boot>-<n>": n counts up per process, and boot tells this
+# process apart from earlier runs and other workers, whose ids mean nothing here.
+class ChangeFeed:
+    def __init__(self, buffer_size=1000, heartbeat=15):
+        self.events = deque(maxlen=buffer_size)
+        self.boot = uuid.uuid4().hex[:12]
+        self.last_id = 0
+        self.heartbeat = heartbeat
+        self.condition = threading.Condition()
+
+    def publish(self, topic, op, row_id, fields=None):
+        with self.condition:
+            self.last_id += 1
+            self.events.append({'id': self.last_id, 'topic': topic, 'op': op, 'row_id': row_id, 'fields': fields or {}})
+            self.condition.notify_all()
+
+    # Last-Event-ID as a counter of this process, or -1 if it was issued by
+    # another process or cannot be read
+    def resume_id(self, value):
+        boot, _, n = value.rpartition('-')
+        if boot != self.boot or not n.isdigit():
+            return -1
+        return int(n)
+
+    # Events after last_id, or None if the client has to refetch: the buffer no
+    # longer reaches back that far, or last_id is not from this process
+    def since(self, last_id):
+        if last_id < 0 or last_id > self.last_id:
+            return None
+        if self.events and last_id < self.events[0]['id'] - 1:
+            return None
+        return [event for event in self.events if event['id'] > last_id]
+
+    def stream(self, topics, last_id=None):
+        if last_id is None:
+            last_id = self.last_id
+        while True:
+            with self.condition:
+                events = self.since(last_id)
+                if events == []:
+                    self.condition.wait(self.heartbeat)
+                    events = self.since(last_id)
+                reset_id = self.last_id
+            if events is None:
+                # The client was away or fell behind too far to resume, tell it to refetch
+                yield f'id: {self.boot}-{reset_id}\nevent: reset\ndata: {{}}\n\n'
+                last_id = reset_id
+                continue
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                last_id = event['id']
+                if event['topic'] in topics:
+                    yield format_event(self.boot, event)
+
+    # Register GET /api/stream on an app serving the given topics
+    def init_app(self, app, topics):
+        topics = set(topics)
+
+        @app.route('/api/stream', methods=['GET'])
+        def stream_changes():
+            requested = request.args.get('topics')
+            selected = set(requested.split(',')) if requested else topics
+            if selected - topics:
+                return jsonify({"error": f"Topics not published by this service: {', '.join(sorted(selected - topics))}",
+                                "topics": sorted(topics)}), 400
+            last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+            last_id = self.resume_id(last_id) if last_id is not None else None
+            response = Response(stream_with_context(self.stream(selected, last_id)), mimetype='text/event-stream')
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
+
+        return stream_changes
+
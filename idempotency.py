@@ -0,0 +1,209 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, jsonify, make_response, request
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text
+from sqlalchemy.exc import IntegrityError
+
+HEADER = 'Idempotency-Key'
+
+metadata = MetaData()
+
+# Stored first responses for the table backend. status_code is NULL while the
+# first request is still running, and expires_at is then only a short lease.
+idempotency_keys = Table(
+    'idempotency_keys', metadata,
+    Column('key', String(300), primary_key=True),
+    Column('fingerprint', String(64), nullable=False),
+    Column('status_code', Integer),
+    Column('content_type', String(100)),
+    Column('body', Text),
+    Column('expires_at', Float, nullable=False, index=True),
+)
+
+
+# Bounded in-process store. Duplicates arriving while the first request runs
+# wait on its event instead of executing the handler again.
+class MemoryBackend:
+    def __init__(self, maxsize=10000, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    # ('new', None), ('done', entry) or ('in_flight', entry)
+    def begin(self, key, fingerprint):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['expires_at'] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.entries[key] = {'fingerprint': fingerprint, 'response': None, 'done': threading.Event(),
+                                     'expires_at': time.time() + self.ttl}
+                while len(self.entries) > self.maxsize:
+                    # Anyone still waiting on an evicted key gets a 409 rather than hanging
+                    self.entries.popitem(last=False)[1]['done'].set()
+                return 'new', None
+            return ('done' if entry['response'] is not None else 'in_flight'), entry
+
+    def wait(self, key, entry, timeout):
+        entry['done'].wait(timeout)
+        return entry if entry['response'] is not None else None
+
+    def finish(self, key, response):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['response'] = response
+                entry['done'].set()
+
+    # The first request failed, let the next retry run the handler again
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry['done'].set()
+
+
+# Store in the database so every worker and service shares keys. A key whose
+# first request is still running holds a lease of `lease` seconds, so one left
+# behind by a crashed worker is taken over by a retry after the lease instead
+# of answering 409 until the TTL.
+class TableBackend:
+    def __init__(self, engine, ttl=86400, lease=30, poll=0.05):
+        self.engine = engine
+        self.ttl = ttl
+        self.lease = lease
+        self.poll = poll
+        self.begins = 0
+        metadata.create_all(engine)
+
+    def select(self, key):
+        with self.engine.connect() as conn:
+            return conn.execute(idempotency_keys.select().where(idempotency_keys.c.key == key)).fetchone()
+
+    def entry(self, row):
+        response = None
+        if row.status_code is not None:
+            response = {'status': row.status_code, 'content_type': row.content_type, 'body': row.body}
+        return {'fingerprint': row.fingerprint, 'response': response}
+
+    def begin(self, key, fingerprint):
+        self.begins += 1
+        if self.begins % 100 == 0:
+            self.purge()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(idempotency_keys.insert().values(key=key, fingerprint=fingerprint,
+                                                              expires_at=time.time() + self.lease))
+            return 'new', None
+        except IntegrityError:
+            row = self.select(key)
+        if row is None or row.expires_at < time.time():
+            self.expire(key)
+            return self.begin(key, fingerprint)
+        entry = self.entry(row)
+        return ('done' if entry['response'] is not None else 'in_flight'), entry
+
+    def wait(self, key, entry, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(self.poll)
+            row = self.select(key)
+            if row is None:
+                return None
+            if row.status_code is not None:
+                return self.entry(row)
+        return None
+
+    def finish(self, key, response):
+        with self.engine.begin() as conn:
+            conn.execute(idempotency_keys.update().where(idempotency_keys.c.key == key).values(
+                status_code=response['status'], content_type=response['content_type'], body=response['body'],
+                expires_at=time.time() + self.ttl))
+
+    def release(self, key):
+        with self.engine.begin() as conn:
+            conn.execute(idempotency_keys.delete().where(idempotency_keys.c.key == key))
+
+    # Only while still expired, another retry may have taken the key over already
+    def expire(self, key):
+        with self.engine.begin() as conn:
+            conn.execute(idempotency_keys.delete().where(idempotency_keys.c.key == key)
+                         .where(idempotency_keys.c.expires_at < time.time()))
+
+    def purge(self):
+        with self.engine.begin() as conn:
+            conn.execute(idempotency_keys.delete().where(idempotency_keys.c.expires_at < time.time()))
+
+
+def stored_response(response, replayed):
+    result = Response(response['body'], status=response['status'], content_type=response['content_type'])
+    result.headers['Idempotent-Replayed'] = 'true' if replayed else 'false'
+    return result
+
+
+# Makes a write view safe to retry with an Idempotency-Key header: the first
+# response is stored and returned again for the same key, without running
+# the view. Requests without the header are untouched.
+class Idempotency:
+    def __init__(self, backend, wait_timeout=30):
+        self.backend = backend
+        self.wait_timeout = wait_timeout
+
+    def __call__(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            idempotency_key = request.headers.get(HEADER)
+            if not idempotency_key:
+                return view(*args, **kwargs)
+
+            # Stored as a hash, so keys and paths of any length fit the key column
+            key = hashlib.sha256(f'{request.method} {request.path} {idempotency_key}'.encode('utf-8')).hexdigest()
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+            state, entry = self.backend.begin(key, fingerprint)
+            if state != 'new' and entry['fingerprint'] != fingerprint:
+                return jsonify({"error": f"{HEADER} was already used with a different request body"}), 422
+            if state == 'in_flight':
+                entry = self.backend.wait(key, entry, self.wait_timeout)
+                if entry is None:
+                    return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            if state != 'new':
+                return stored_response(entry['response'], True)
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                self.backend.release(key)
+                raise
+            if response.status_code >= 500:
+                self.backend.release(key)
+                return response
+            stored = {'status': response.status_code, 'content_type': response.content_type,
+                      'body': response.get_data(as_text=True)}
+            self.backend.finish(key, stored)
+            response.headers['Idempotent-Replayed'] = 'false'
+            return response
+
+        return wrapper
+
+
+# IDEMPOTENCY_BACKEND=table stores keys in the database, otherwise in process.
+# IDEMPOTENCY_TTL is in seconds, IDEMPOTENCY_SIZE bounds the in-process store.
+# IDEMPOTENCY_WAIT is how long duplicates wait for the first request, and the
+# lease a running request holds on its key in the table.
+def create_idempotency(app, db):
+    ttl = int(app.config.get('IDEMPOTENCY_TTL', os.getenv('IDEMPOTENCY_TTL', 86400)))
+    wait_timeout = int(app.config.get('IDEMPOTENCY_WAIT', os.getenv('IDEMPOTENCY_WAIT', 30)))
+    if app.config.get('IDEMPOTENCY_BACKEND', os.getenv('IDEMPOTENCY_BACKEND', 'memory')) == 'table':
+        with app.app_context():
+            backend = TableBackend(db.engine, ttl=ttl, lease=wait_timeout)
+    else:
+        backend = MemoryBackend(maxsize=int(app.config.get('IDEMPOTENCY_SIZE', os.getenv('IDEMPOTENCY_SIZE', 10000))),
+                                ttl=ttl)
+    return Idempotency(backend, wait_timeout=wait_timeout)
@@ -0,0 +1,231 @@
+import cProfile
+import hashlib
+import hmac
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import Response, abort, g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TOKEN_HEADER = 'X-Profile-Token'
+
+
+# Token accepted in the X-Profile-Token header: "<expires>:<hmac of expires>"
+def make_token(secret, ttl=300):
+    expires = str(int(time.time()) + ttl)
+    signature = hmac.new(secret.encode('utf-8'), expires.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f'{expires}:{signature}'
+
+
+def check_token(secret, token):
+    if not secret or not token or ':' not in token:
+        return False
+    expires, signature = token.split(':', 1)
+    expected = hmac.new(secret.encode('utf-8'), expires.encode('utf-8'), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected) and expires.isdigit() and int(expires) >= time.time()
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# Samples one thread's stack on a background thread until stopped
+class StackSampler:
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+# Opt-in per-request profiler. A request is profiled when it carries a valid
+# X-Profile-Token or is picked by PROFILER_SAMPLE_RATE. PROFILER_SECRET is
+# required to enable it, without one no hooks are installed at all.
+class RequestProfiler:
+    def __init__(self, app=None):
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.active = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.secret = app.config.get('PROFILER_SECRET', os.getenv('PROFILER_SECRET'))
+        self.sample_rate = float(app.config.get('PROFILER_SAMPLE_RATE', os.getenv('PROFILER_SAMPLE_RATE', 0)))
+        self.keep = int(app.config.get('PROFILER_KEEP', os.getenv('PROFILER_KEEP', 20)))
+        self.mode = app.config.get('PROFILER_MODE', os.getenv('PROFILER_MODE', 'cprofile'))
+        self.interval = float(app.config.get('PROFILER_INTERVAL', os.getenv('PROFILER_INTERVAL', 0.005)))
+        if not self.secret:
+            if self.sample_rate:
+                # Sampled profiles could never be downloaded, the endpoints need a token
+                raise ValueError('PROFILER_SAMPLE_RATE is set but PROFILER_SECRET is not, set both to enable the profiler')
+            return
+
+        app.before_request(self.start)
+        app.after_request(self.stop)
+        app.teardown_request(self.discard)
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+        app.add_url_rule('/api/admin/profiles', 'list_profiles', self.list_profiles, methods=['GET'])
+        app.add_url_rule('/api/admin/profiles/<int:profile_id>', 'get_profile', self.get_profile, methods=['GET'])
+
+    def wanted(self):
+        if request.path.startswith('/api/admin/profiles'):
+            return False
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        return check_token(self.secret, request.headers.get(TOKEN_HEADER))
+
+    def start(self):
+        if not self.wanted():
+            return
+        entry = {
+            # Unmatched paths share one key, so 404 scans cannot grow the per-route stats
+            'route': request.url_rule.rule if request.url_rule else '<unmatched>',
+            'method': request.method,
+            'path': request.path,
+            'started': time.time(),
+            'sql': [],
+        }
+        if self.mode == 'sample':
+            entry['sampler'] = StackSampler(threading.get_ident(), self.interval)
+            entry['sampler'].start()
+        else:
+            entry['profile'] = cProfile.Profile()
+            try:
+                entry['profile'].enable()
+            except ValueError:
+                # Python 3.12+ allows one active cProfile per process, skip this request
+                return
+        g.profile_entry = entry
+        self.active.entry = entry
+
+    def stop(self, response):
+        entry = g.pop('profile_entry', None)
+        if entry is None:
+            return response
+        if 'sampler' in entry:
+            entry['sampler'].stop()
+            entry['stacks'] = entry.pop('sampler').stacks
+        else:
+            entry['profile'].disable()
+            entry['profile'].create_stats()
+        self.active.entry = None
+        entry['duration'] = time.time() - entry['started']
+        entry['status'] = response.status_code
+
+        with self.lock:
+            self.last_id += 1
+            entry['id'] = self.last_id
+            self.profiles.setdefault(entry['route'], deque(maxlen=self.keep)).append(entry)
+        response.headers['X-Profile-Id'] = str(entry['id'])
+        return response
+
+    # Drop a profile left running when the request failed before after_request
+    def discard(self, exc=None):
+        entry = g.pop('profile_entry', None)
+        if entry is not None:
+            if 'sampler' in entry:
+                entry['sampler'].stop()
+            else:
+                entry['profile'].disable()
+        self.active.entry = None
+
+    # SQL is attributed to the profiled request running on the same thread
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self.active, 'entry', None) is not None:
+            conn.info.setdefault('profile_query_start', []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        entry = getattr(self.active, 'entry', None)
+        if entry is not None and conn.info.get('profile_query_start'):
+            entry['sql'].append({'statement': statement,
+                                 'duration': time.time() - conn.info['profile_query_start'].pop()})
+
+    def require_token(self):
+        if not check_token(self.secret, request.headers.get(TOKEN_HEADER)):
+            abort(403)
+
+    def find(self, profile_id):
+        with self.lock:
+            for entries in self.profiles.values():
+                for entry in entries:
+                    if entry['id'] == profile_id:
+                        return entry
+        abort(404)
+
+    def list_profiles(self):
+        self.require_token()
+        with self.lock:
+            result = {route: [{
+                'id': entry['id'],
+                'method': entry['method'],
+                'path': entry['path'],
+                'status': entry['status'],
+                'started': entry['started'],
+                'duration': entry['duration'],
+                'sql_count': len(entry['sql']),
+                'sql_time': sum(query['duration'] for query in entry['sql']),
+                'kind': 'sample' if 'stacks' in entry else 'cprofile',
+            } for entry in entries] for route, entries in self.profiles.items()}
+        return jsonify(result)
+
+    # ?format=pstats (binary, for snakeviz/pstats), text, collapsed (flamegraph.pl) or sql
+    def get_profile(self, profile_id):
+        self.require_token()
+        entry = self.find(profile_id)
+        output = request.args.get('format', 'text')
+
+        if output == 'sql':
+            return jsonify(entry['sql'])
+        if output == 'collapsed':
+            if 'stacks' not in entry:
+                return jsonify({"error": "Collapsed stacks need PROFILER_MODE=sample"}), 400
+            lines = [f'{stack} {count}' for stack, count in entry['stacks'].most_common()]
+            return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+        if 'profile' not in entry:
+            return jsonify({"error": "pstats output needs PROFILER_MODE=cprofile"}), 400
+        if output == 'pstats':
+            response = Response(marshal.dumps(entry['profile'].stats), mimetype='application/octet-stream')
+            response.headers['Content-Disposition'] = f'attachment; filename=profile-{profile_id}.prof'
+            return response
+        stream = io.StringIO()
+        pstats.Stats(entry['profile'], stream=stream).sort_stats('cumulative').print_stats(50)
+        return Response(stream.getvalue(), mimetype='text/plain')
+
+
+if __name__ == '__main__':
+    # Print a token for the X-Profile-Token header
+    secret = os.getenv('PROFILER_SECRET')
+    if not secret:
+        sys.exit('PROFILER_SECRET is not set')
+    print(make_token(secret, int(sys.argv[1]) if len(sys.argv) > 1 else 300))
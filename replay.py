@@ -0,0 +1,191 @@
+import argparse
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Default local ports of each service, matching their app.run() calls
+DEFAULT_TARGETS = {
+    'fd': 'http://localhost:5005',
+    'pay': 'http://localhost:5001',
+    'prod': 'http://localhost:5004',
+    'author': 'http://localhost:5006',
+}
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def load_capture(path):
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+# /api/milk_details/42 -> /api/milk_details/{id}, so results group by endpoint
+def route_key(record):
+    path = re.sub(r'/\d+(?=/|$)', '/{id}', record['path'])
+    return f"{record['method']} {path}"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Latency is measured from `scheduled`, when the request was due to be sent,
+# so time spent queued behind a saturated pool counts against the service
+# instead of being hidden (coordinated omission)
+def send(record, targets, timeout, scheduled):
+    url = targets[record['service']] + record['path']
+    if record.get('query'):
+        url += '?' + record['query']
+    data = json.dumps(record['body']).encode('utf-8') if record.get('body') is not None else None
+    req = urllib.request.Request(url, data=data, method=record['method'])
+    if data is not None:
+        req.add_header('Content-Type', 'application/json')
+    for name, value in record.get('headers', {}).items():
+        req.add_header(name, value)
+
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = None
+    return {'route': route_key(record), 'status': status, 'latency': time.perf_counter() - scheduled}
+
+
+# Re-issue the capture. speed=None sends as fast as the pool allows, otherwise
+# the original gaps between requests are kept, divided by speed.
+def replay(records, targets, speed=1.0, workers=16, timeout=30):
+    results = []
+    lock = threading.Lock()
+
+    def run(record, scheduled):
+        result = send(record, targets, timeout, scheduled)
+        with lock:
+            results.append(result)
+
+    started = time.perf_counter()
+    first = records[0]['time'] if records else 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record in records:
+            scheduled = time.perf_counter()
+            if speed:
+                scheduled = started + (record['time'] - first) / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(run, record, scheduled)
+    return results, time.perf_counter() - started
+
+
+def summarize(results):
+    latencies = sorted(result['latency'] for result in results)
+    errors = sum(1 for result in results if result['status'] is None or result['status'] >= 500)
+    summary = {'requests': len(results), 'errors': errors,
+               'error_rate': errors / len(results) if results else 0.0}
+    for p in PERCENTILES:
+        summary[f'p{p}'] = percentile(latencies, p)
+    summary['max'] = latencies[-1] if latencies else None
+    return summary
+
+
+def report(results, elapsed):
+    routes = {}
+    for result in results:
+        routes.setdefault(result['route'], []).append(result)
+    return {
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed if elapsed else None,
+        'overall': summarize(results),
+        'routes': {route: summarize(route_results) for route, route_results in sorted(routes.items())},
+    }
+
+
+# Change of every percentile and the error rate against a previous report
+def diff_reports(previous, current):
+    def diff(old, new):
+        changes = {}
+        for name in [f'p{p}' for p in PERCENTILES] + ['max', 'error_rate']:
+            if old.get(name) is None or new.get(name) is None:
+                continue
+            changes[name] = {'before': old[name], 'after': new[name], 'change': new[name] - old[name]}
+            if old[name]:
+                changes[name]['change_pct'] = (new[name] - old[name]) / old[name] * 100
+        return changes
+
+    result = {'overall': diff(previous['overall'], current['overall']), 'routes': {}}
+    for route, summary in current['routes'].items():
+        if route in previous['routes']:
+            result['routes'][route] = diff(previous['routes'][route], summary)
+    return result
+
+
+def print_report(result):
+    overall = result['overall']
+    print(f"{overall['requests']} requests in {result['elapsed']:.2f}s, "
+          f"{overall['errors']} errors ({overall['error_rate']:.2%})")
+    print(f"{'route':50} {'count':>6} {'err%':>6} " + ' '.join(f'{f"p{p}":>9}' for p in PERCENTILES))
+    for route, summary in result['routes'].items():
+        values = ' '.join(f"{summary[f'p{p}'] * 1000:7.1f}ms" for p in PERCENTILES)
+        print(f"{route:50} {summary['requests']:6} {summary['error_rate']:6.1%} {values}")
+
+
+def print_diff(changes):
+    print('\nAgainst previous run (p95 / error rate):')
+    for route, route_changes in changes['routes'].items():
+        p95 = route_changes.get('p95')
+        errors = route_changes.get('error_rate')
+        line = f'{route:50}'
+        if p95:
+            line += f" p95 {p95['before'] * 1000:7.1f}ms -> {p95['after'] * 1000:7.1f}ms"
+            if 'change_pct' in p95:
+                line += f" ({p95['change_pct']:+.1f}%)"
+        if errors:
+            line += f" errors {errors['before']:.1%} -> {errors['after']:.1%}"
+        print(line)
+
+
+def parse_speed(value):
+    if value == 'max':
+        return None
+    return float(value.rstrip('x'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a traffic capture against local services')
+    parser.add_argument('capture', help='JSON lines file written by capture.py')
+    parser.add_argument('--target', action='append', default=[],
+                        help='service=base_url, e.g. fd=http://localhost:5005 (repeatable)')
+    parser.add_argument('--speed', default='1', help="1, 5x, ... or 'max' to ignore the captured gaps")
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='Write the JSON report here')
+    parser.add_argument('--compare', help='Previous JSON report to diff against')
+    args = parser.parse_args()
+
+    targets = dict(DEFAULT_TARGETS)
+    for target in args.target:
+        service, url = target.split('=', 1)
+        targets[service] = url.rstrip('/')
+
+    results, elapsed = replay(load_capture(args.capture), targets, parse_speed(args.speed), args.workers, args.timeout)
+    result = report(results, elapsed)
+    print_report(result)
+
+    if args.compare:
+        with open(args.compare) as f:
+            result['diff'] = diff_reports(json.load(f), result)
+        print_diff(result['diff'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,191 @@
+import argparse
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+
+
+# Stable hash of the shard key. Python's built-in hash() is randomised per
+# process, so crc32 is used to make every worker agree on the same shard.
+def shard_index(key, num_shards):
+    return zlib.crc32(key.encode('utf-8')) % num_shards
+
+
+def parse_shard_urls(value):
+    return [url.strip() for url in value.split(',') if url.strip()]
+
+
+# What a URL actually points at, so two spellings of one database compare
+# equal: drivers and credentials are ignored, SQLite paths are resolved.
+def database_identity(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == 'sqlite':
+        if not url.database or url.database == ':memory:':
+            return (backend, None)
+        return (backend, os.path.realpath(url.database))
+    return (backend, url.host, url.port, url.database)
+
+
+def same_database(a, b):
+    return database_identity(a) == database_identity(b)
+
+
+# Routes reads and writes of one model to N databases by hashing a key column
+class ShardRouter:
+    def __init__(self, model, urls, key='farm_name', max_workers=None):
+        if not urls:
+            raise ValueError('At least one shard URL is required')
+        self.model = model
+        self.key = key
+        self.urls = list(urls)
+        self.engines = [create_engine(url) for url in self.urls]
+        self.sessionmakers = [sessionmaker(bind=engine, expire_on_commit=False) for engine in self.engines]
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(self.engines))
+
+    @property
+    def num_shards(self):
+        return len(self.engines)
+
+    def shard_for(self, key):
+        return shard_index(key, self.num_shards)
+
+    # Create the model's table on every shard
+    def create_all(self):
+        for engine in self.engines:
+            self.model.__table__.create(engine, checkfirst=True)
+
+    # Session on a single shard, committed on success and rolled back on error
+    @contextmanager
+    def session_for_index(self, index):
+        session = self.sessionmakers[index]()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def session(self, key):
+        return self.session_for_index(self.shard_for(key))
+
+    # Run fn(session) on every shard in parallel and return the results in shard order
+    def fan_out(self, fn):
+        def run(index):
+            with self.session_for_index(index) as session:
+                return fn(session)
+        return list(self.executor.map(run, range(self.num_shards)))
+
+    # Cross-shard SELECT * merged back into primary key order
+    def all(self):
+        results = self.fan_out(lambda session: session.query(self.model).all())
+        rows = [row for shard_rows in results for row in shard_rows]
+        rows.sort(key=lambda row: row.id)
+        return rows
+
+
+# Run fn(connection) in one transaction on every shard in MILK_SHARD_URLS
+# other than the database at main_url. Alembic only connects to the main
+# database, the migrations use this to change milk_details on the others.
+def for_each_shard(main_url, fn):
+    for url in parse_shard_urls(os.getenv('MILK_SHARD_URLS', '')):
+        if same_database(url, main_url):
+            continue
+        engine = create_engine(url)
+        try:
+            with engine.begin() as conn:
+                fn(conn)
+        finally:
+            engine.dispose()
+
+
+# Delete a farm's stale copies from one shard, leaving its live rows alone
+def drop_stale(router, index, model, key, farm, owners, batch_size):
+    last_id = 0
+    while True:
+        with router.session_for_index(index) as session:
+            rows = (session.query(model).filter(getattr(model, key) == farm).filter(model.id > last_id)
+                    .order_by(model.id).limit(batch_size).all())
+            if not rows:
+                return
+            current = owners([row.id for row in rows])
+            for row in rows:
+                if current.get(row.id) != farm:
+                    session.delete(row)
+            last_id = rows[-1].id
+
+
+# Move every row whose shard changes between two layouts. Rows keep their ids.
+# owners(ids), if given, returns the current key of each id; rows whose key
+# differs are stale copies left by an interrupted move and are only deleted.
+def reshard(model, old_urls, new_urls, key='farm_name', batch_size=500, owners=None):
+    old = ShardRouter(model, old_urls, key=key)
+    new = ShardRouter(model, new_urls, key=key)
+    new.create_all()
+    columns = [column.name for column in model.__table__.columns]
+    moved = 0
+    try:
+        for index, url in enumerate(old.urls):
+            with old.session_for_index(index) as source:
+                farms = [value for (value,) in source.query(getattr(model, key)).distinct().all()]
+            for farm in farms:
+                target_index = new.shard_for(farm)
+                # Farms that hash to the same database in both layouts stay put.
+                # Compared by identity, deleting "copied" rows from the database
+                # they were copied to would lose them.
+                if same_database(new.urls[target_index], url):
+                    if owners:
+                        drop_stale(old, index, model, key, farm, owners, batch_size)
+                    continue
+                while True:
+                    with old.session_for_index(index) as source:
+                        rows = source.query(model).filter(getattr(model, key) == farm).limit(batch_size).all()
+                        if not rows:
+                            break
+                        current = owners([row.id for row in rows]) if owners else None
+                        # Rows already copied by a run that crashed before its
+                        # source delete are skipped, so a rerun finishes the move.
+                        # Only the same farm's rows count, another row with the
+                        # id fails the insert instead of deleting this one.
+                        with new.session_for_index(target_index) as target:
+                            copied = {id for (id,) in target.query(model.id).filter(
+                                model.id.in_([row.id for row in rows])).filter(getattr(model, key) == farm).all()}
+                            for row in rows:
+                                if current is not None and current.get(row.id) != farm:
+                                    continue
+                                if row.id not in copied:
+                                    target.execute(model.__table__.insert().values(
+                                        **{name: getattr(row, name) for name in columns}))
+                                moved += 1
+                        for row in rows:
+                            source.delete(row)
+    finally:
+        old.executor.shutdown()
+        new.executor.shutdown()
+    return moved
+
+
+if __name__ == '__main__':
+    from fd import MilkDetailId, MilkDetail, app
+
+    # The id directory tells a live row from the stale copy of a moved one
+    def milk_owners(ids):
+        with app.app_context():
+            return dict(MilkDetailId.query.with_entities(MilkDetailId.id, MilkDetailId.farm_name)
+                        .filter(MilkDetailId.id.in_(ids)).all())
+
+    parser = argparse.ArgumentParser(description='Move milk_details rows between shard layouts')
+    parser.add_argument('--from', dest='old', required=True, help='Comma separated current shard URLs')
+    parser.add_argument('--to', dest='new', required=True, help='Comma separated new shard URLs')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    moved = reshard(MilkDetail, parse_shard_urls(args.old), parse_shard_urls(args.new), batch_size=args.batch_size,
+                    owners=milk_owners)
+    print(f'Moved {moved} milk_details rows')
@@ -0,0 +1,133 @@
+import threading
+import time
+
+from sqlalchemy import Column, Integer, MetaData, SmallInteger, String, Table, UniqueConstraint
+from sqlalchemy.exc import IntegrityError
+
+metadata = MetaData()
+
+# Every status string in use, with a compact code and the number of rows using it
+status_vocabulary = Table(
+    'status_vocabulary', metadata,
+    Column('id', SmallInteger().with_variant(Integer, 'sqlite'), primary_key=True),
+    Column('kind', String(20), nullable=False),
+    Column('name', String(20), nullable=False),
+    Column('ref_count', Integer, nullable=False, default=0),
+    UniqueConstraint('kind', 'name', name='uq_status_vocabulary_kind_name'),
+)
+
+
+# In-memory copy of status_vocabulary. Codes never change once assigned so
+# they are cached for good; ref counts are updated by this process's writes
+# and re-read from the table every `refresh` seconds to pick up other workers.
+class StatusVocabulary:
+    def __init__(self, refresh=10):
+        self.engine = None
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.codes = {}
+        self.kinds = {}
+        self.names = {}
+        self.ref_counts = {}
+        self.seeded = set()
+        self.loaded = 0
+
+    def bind(self, engine, seed=None):
+        self.engine = engine
+        metadata.create_all(engine)
+        for kind, names in (seed or {}).items():
+            for name in names:
+                self.seeded.add(self.code(kind, name))
+        self.load()
+
+    def load(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(status_vocabulary.select()).fetchall()
+        with self.lock:
+            for row in rows:
+                self.remember(row.kind, row.name, row.id)
+                self.ref_counts[row.id] = row.ref_count
+            self.loaded = time.monotonic()
+
+    # Code for a status, adding it to the vocabulary the first time it is seen
+    def code(self, kind, name):
+        if name is None:
+            return None
+        code = self.codes.get((kind, name))
+        if code is None:
+            # Another worker may have added it since the last load
+            self.load()
+            code = self.codes.get((kind, name))
+        if code is not None:
+            return code
+        try:
+            with self.engine.begin() as conn:
+                code = conn.execute(status_vocabulary.insert().values(kind=kind, name=name, ref_count=0)).inserted_primary_key[0]
+        except IntegrityError:
+            # Another worker added it first
+            with self.engine.connect() as conn:
+                code = conn.execute(status_vocabulary.select().where(status_vocabulary.c.kind == kind)
+                                    .where(status_vocabulary.c.name == name)).fetchone().id
+        with self.lock:
+            self.remember(kind, name, code)
+            self.ref_counts.setdefault(code, 0)
+        return code
+
+    def remember(self, kind, name, code):
+        self.codes[(kind, name)] = code
+        self.kinds.setdefault(kind, {})[name] = code
+        self.names[code] = name
+
+    def name(self, code):
+        if code is None:
+            return None
+        name = self.names.get(code)
+        if name is None:
+            self.load()
+            name = self.names.get(code)
+        return name
+
+    # Adjust ref counts inside the session writing the row, so both commit or
+    # roll back together. deltas maps (kind, name) to a change; deltas for one
+    # code are summed and the rows updated in code order, so two writers
+    # always lock vocabulary rows in the same order and cannot deadlock. A
+    # rolled back delta in the in-memory copy is corrected by the next load.
+    def add_refs(self, session, deltas):
+        totals = {}
+        for (kind, name), delta in deltas.items():
+            if name is None or not delta:
+                continue
+            code = self.code(kind, name)
+            totals[code] = totals.get(code, 0) + delta
+        for code in sorted(totals):
+            if not totals[code]:
+                continue
+            session.execute(status_vocabulary.update().where(status_vocabulary.c.id == code)
+                            .values(ref_count=status_vocabulary.c.ref_count + totals[code]))
+        with self.lock:
+            for code, delta in totals.items():
+                self.ref_counts[code] = self.ref_counts.get(code, 0) + delta
+
+    def add_ref(self, session, kind, name, delta):
+        self.add_refs(session, {(kind, name): delta})
+
+    # Statuses of a kind, by default only the seeded ones and those some row
+    # still uses
+    def statuses(self, kind, in_use=True):
+        if time.monotonic() - self.loaded > self.refresh:
+            self.load()
+        with self.lock:
+            return [name for name, code in self.kinds.get(kind, {}).items()
+                    if not in_use or code in self.seeded or self.ref_counts.get(code, 0) > 0]
+
+
+# Model attribute that reads and writes a status by name while the mapped
+# column `column` stores its code
+def status_property(vocabulary, kind, column):
+    def get(self):
+        return vocabulary.name(getattr(self, column))
+
+    def set(self, value):
+        setattr(self, column, vocabulary.code(kind, value))
+
+    return property(get, set)
@@ -0,0 +1,133 @@
+import heapq
+import time
+
+from flask import jsonify, request
+from sqlalchemy import BigInteger, Boolean, Column, Float, Index, Integer, MetaData, String, Table, and_, func, or_, select
+
+metadata = MetaData()
+
+# Source of change sequence numbers shared by every service. A seq is reserved
+# in its own committed transaction and released in the same transaction as the
+# write that uses it, so sync can tell which seqs may still become visible.
+change_sequence = Table(
+    'change_sequence', metadata,
+    Column('id', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True),
+    Column('reserved_at', Float, nullable=False),
+    Column('released', Boolean, nullable=False, default=False),
+    sqlite_autoincrement=True,
+)
+
+# Deleted rows, kept so offline clients learn about deletes on their next sync
+sync_tombstones = Table(
+    'sync_tombstones', metadata,
+    Column('change_seq', BigInteger, primary_key=True, autoincrement=False),
+    Column('table_name', String(50), nullable=False),
+    Column('row_id', Integer, nullable=False),
+    Index('ix_sync_tombstones_table_name_change_seq', 'table_name', 'change_seq'),
+)
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+# Seconds after which a reserved but unreleased seq is taken as abandoned, e.g.
+# by a worker that crashed between reserving it and writing its row
+IN_FLIGHT_LEASE = 60
+# Postgres can commit reservations out of order, so seqs reserved this recently
+# are held back from sync even once released
+RESERVE_LAG = 5
+# Settled seqs are purged every this many reservations
+PURGE_EVERY = 1000
+
+
+def create_sync_tables(engine):
+    metadata.create_all(engine)
+
+
+def reserve_change_seq(engine):
+    with engine.begin() as conn:
+        seq = conn.execute(change_sequence.insert().values(reserved_at=time.time(), released=False)).inserted_primary_key[0]
+        if seq % PURGE_EVERY == 0:
+            # The newest row is kept, it is the high-water mark for change_horizon()
+            conn.execute(change_sequence.delete().where(change_sequence.c.id < seq)
+                         .where(change_sequence.c.reserved_at < time.time() - IN_FLIGHT_LEASE))
+    return seq
+
+
+# Queue the release in the session holding the write, they commit together
+def release_change_seq(session, seq):
+    session.execute(change_sequence.update().where(change_sequence.c.id == seq).values(released=True))
+
+
+# Seq for a write to the session's own database
+def next_change_seq(session):
+    seq = reserve_change_seq(session.get_bind())
+    release_change_seq(session, seq)
+    return seq
+
+
+def add_tombstone(session, table_name, row_id):
+    session.execute(sync_tombstones.insert().values(
+        change_seq=next_change_seq(session), table_name=table_name, row_id=row_id))
+
+
+# Rows of one model changed after `since`, oldest first, as sync entries
+def changed_rows(query, model, dump, since, limit):
+    rows = query.filter(model.change_seq > since).order_by(model.change_seq).limit(limit).all()
+    return [{'seq': row.change_seq, 'table': model.__tablename__, 'op': 'upsert', 'id': row.id, 'row': dump(row)}
+            for row in rows]
+
+
+def tombstones(session, table_names, since, limit):
+    rows = session.execute(
+        sync_tombstones.select()
+        .where(sync_tombstones.c.table_name.in_(table_names))
+        .where(sync_tombstones.c.change_seq > since)
+        .order_by(sync_tombstones.c.change_seq)
+        .limit(limit)
+    ).fetchall()
+    return [{'seq': row.change_seq, 'table': row.table_name, 'op': 'delete', 'id': row.row_id} for row in rows]
+
+
+# Every seq below the horizon is settled: its write has committed, or was
+# abandoned. Changes at or above it are held back until a later sync.
+def change_horizon(engine):
+    now = time.time()
+    with engine.connect() as conn:
+        highest = conn.execute(select(func.max(change_sequence.c.id))).scalar() or 0
+        pending = conn.execute(select(func.min(change_sequence.c.id)).where(or_(
+            change_sequence.c.reserved_at > now - RESERVE_LAG,
+            and_(change_sequence.c.released.is_(False), change_sequence.c.reserved_at > now - IN_FLIGHT_LEASE),
+        ))).scalar()
+    return pending if pending is not None else highest + 1
+
+
+# Merge lists of sync entries that are each already in seq order
+def merge_changes(results, limit):
+    return list(heapq.merge(*results, key=lambda change: change['seq']))[:limit]
+
+
+# Register GET /api/sync. Each source is a function (since, limit) returning
+# at most `limit` sync entries in seq order; the first `limit` of their merge
+# is exactly the next page, so each call costs O(changes) via the indexes.
+# The cursor never passes a seq whose write may still commit.
+def init_sync(app, db, sources):
+    @app.route('/api/sync', methods=['GET'])
+    def sync_changes():
+        try:
+            since = int(request.args.get('since', 0))
+            limit = min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        except ValueError:
+            return jsonify({"error": "since and limit must be integers"}), 400
+        if limit < 1:
+            return jsonify({"error": "limit must be positive"}), 400
+
+        # Taken before reading the sources: anything below it is already visible
+        horizon = change_horizon(db.engine)
+        results = [source(since, limit + 1) for source in sources]
+        changes = [change for change in merge_changes(results, limit + 1) if change['seq'] < horizon]
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        cursor = changes[-1]['seq'] if changes else since
+        return jsonify({'changes': changes, 'cursor': cursor, 'has_more': has_more})
+
+    return sync_changes